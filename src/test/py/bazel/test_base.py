@@ -55,6 +55,7 @@ class TestBase(absltest.TestCase):
   _worker_stderr = None
   _worker_proc = None
   _cas_path = None
+  _file_contents = None
 
   def WorkspaceContent(self):
     with open(
@@ -72,6 +73,7 @@ class TestBase(absltest.TestCase):
         os.path.join(test_tmpdir, 'tests_root'))
     self._temp = TestBase._CreateDirs(os.path.join(test_tmpdir, 'tmp'))
     self._test_cwd = tempfile.mkdtemp(dir=self._tests_root)
+    self._file_contents = {}
     self._test_bazelrc = os.path.join(self._temp, 'test_bazelrc')
     with open(self._test_bazelrc, 'wt') as f:
       f.write('common --nolegacy_external_runfiles\n')
@@ -164,14 +166,30 @@ class TestBase(absltest.TestCase):
         '(against expectations)', stderr_lines, stdout_lines)
 
   def AssertFileContentContains(self, file_path, entry):
-    with open(file_path, 'r') as f:
-      if entry not in f.read():
-        self.fail('File "%s" does not contain "%s"' % (file_path, entry))
+    if entry not in self._ReadFileContent(file_path):
+      self.fail('File "%s" does not contain "%s"' % (file_path, entry))
 
   def AssertFileContentNotContains(self, file_path, entry):
-    with open(file_path, 'r') as f:
-      if entry in f.read():
-        self.fail('File "%s" does contain "%s"' % (file_path, entry))
+    if entry in self._ReadFileContent(file_path):
+      self.fail('File "%s" does contain "%s"' % (file_path, entry))
+
+  def _ReadFileContent(self, file_path):
+    """Returns the content of `file_path`, reading it only once per snapshot.
+
+    The cached contents are dropped whenever the test writes a scratch file or
+    runs a program (including Bazel), since either may change the file.
+
+    Args:
+      file_path: string; the path of the file to read
+    Returns:
+      string, the content of the file
+    """
+    content = self._file_contents.get(file_path)
+    if content is None:
+      with open(file_path, 'r') as f:
+        content = f.read()
+      self._file_contents[file_path] = content
+    return content
 
   def AssertPathIsSymlink(self, path):
     if self.IsWindows():
@@ -286,8 +304,9 @@ class TestBase(absltest.TestCase):
     Args:
       path: string; a path, relative to the test's scratch directory,
         e.g. "foo/bar/BUILD"
-      lines: [string]; the contents of the file (newlines are added
-        automatically)
+      lines: [string] or string; the contents of the file. For a list,
+        newlines are added automatically after each line; a string is written
+        as-is.
       executable: bool; whether to make the file executable
     Returns:
       The absolute path of the scratch file.
@@ -297,14 +316,19 @@ class TestBase(absltest.TestCase):
     """
     if not path:
       return
-    if lines is not None and not isinstance(lines, list):
-      raise ValueError('expected lines to be a list, got ' + str(type(lines)))
+    if lines is not None and not isinstance(lines, (list, str)):
+      raise ValueError(
+          'expected lines to be a list or a string, got ' + str(type(lines))
+      )
     abspath = self.Path(path)
     if os.path.exists(abspath) and not os.path.isfile(abspath):
       raise IOError('"%s" (%s) exists and is not a file' % (path, abspath))
     self.ScratchDir(os.path.dirname(path))
+    self._file_contents.clear()
     with open(abspath, 'w', encoding='utf-8') as f:
-      if lines:
+      if isinstance(lines, str):
+        f.write(lines)
+      elif lines:
         for l in lines:
           f.write(l)
           f.write('\n')
@@ -312,6 +336,37 @@ class TestBase(absltest.TestCase):
       os.chmod(abspath, stat.S_IRWXU)
     return abspath
 
+  def ScratchFileBytes(self, path, data, executable=False):
+    """Creates a file with the given raw contents under the scratch directory.
+
+    Unlike ScratchFile, the contents are written as-is with a single write
+    call, without any per-line processing or newline translation.
+
+    Args:
+      path: string; a path, relative to the test's scratch directory,
+        e.g. "foo/bar/BUILD"
+      data: bytes; the contents of the file
+      executable: bool; whether to make the file executable
+    Returns:
+      The absolute path of the scratch file.
+    Raises:
+      ArgumentError: if `path` is absolute or contains uplevel references
+      IOError: if an I/O error occurs
+    """
+    if not path:
+      return
+    if not isinstance(data, bytes):
+      raise ValueError('expected data to be bytes, got ' + str(type(data)))
+    abspath = self.Path(path)
+    if os.path.exists(abspath) and not os.path.isfile(abspath):
+      raise IOError('"%s" (%s) exists and is not a file' % (path, abspath))
+    self.ScratchDir(os.path.dirname(path))
+    self._file_contents.clear()
+    TestBase._WriteBytes(abspath, data)
+    if executable:
+      os.chmod(abspath, stat.S_IRWXU)
+    return abspath
+
   def CopyFile(self, src_path, dst_path, executable=False):
     """Copy a file to a path under the test's scratch directory.
 
@@ -332,6 +387,7 @@ class TestBase(absltest.TestCase):
     if os.path.exists(abspath) and not os.path.isfile(abspath):
       raise IOError('"%s" (%s) exists and is not a file' % (dst_path, abspath))
     self.ScratchDir(os.path.dirname(dst_path))
+    self._file_contents.clear()
     with open(src_path, 'rb') as s:
       with open(abspath, 'wb') as d:
         d.write(s.read())
@@ -483,6 +539,7 @@ class TestBase(absltest.TestCase):
     Returns:
       (int, [string], [string]) tuple: exit code, stdout lines, stderr lines
     """
+    self._file_contents.clear()
     with tempfile.TemporaryFile(dir=self._test_cwd) as stdout:
       with tempfile.TemporaryFile(dir=self._test_cwd) as stderr:
         proc = subprocess.Popen(
@@ -560,6 +617,21 @@ class TestBase(absltest.TestCase):
         env[e] = env_add[e]
     return env
 
+  @staticmethod
+  def _WriteBytes(abspath, data):
+    """Writes `data` to `abspath` using unbuffered OS-level writes."""
+    fd = os.open(
+        abspath,
+        os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0),
+        0o666,
+    )
+    try:
+      view = memoryview(data)
+      while view:
+        view = view[os.write(fd, view):]
+    finally:
+      os.close(fd)
+
   @staticmethod
   def _CreateDirs(path):
     if not os.path.exists(path):
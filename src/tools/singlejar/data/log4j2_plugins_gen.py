@@ -19,22 +19,36 @@ python3 src/tools/singlejar/data/log4j2_plugins_gen.py
 """
 
 import argparse
-import io
+import functools
 import os
 import struct
 import sys
+from typing import NamedTuple
 import zipfile
 
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_TWO_BOOLS = struct.Struct(">??")
 
-class PluginEntry:
+# Compiled record layouts, keyed by format string. Many records share the
+# same string lengths, so compilation is amortized across the file.
+_STRUCT_CACHE = {}
 
-  def __init__(self, key, class_name, name, printable, defer, category):
-    self.key = key
-    self.class_name = class_name
-    self.name = name
-    self.printable = printable
-    self.defer = defer
-    self.category = category
+
+def _get_struct(fmt):
+  compiled = _STRUCT_CACHE.get(fmt)
+  if compiled is None:
+    compiled = _STRUCT_CACHE[fmt] = struct.Struct(fmt)
+  return compiled
+
+
+class PluginEntry(NamedTuple):
+  key: str
+  class_name: str
+  name: str
+  printable: bool
+  defer: bool
+  category: str
 
   def __repr__(self):
     return (
@@ -44,70 +58,136 @@ class PluginEntry:
     )
 
 
-def read_utf_string(buffer):
-  length = struct.unpack(">H", buffer.read(2))[0]
-  return buffer.read(length).decode("utf-8")
+@functools.lru_cache(maxsize=None)
+def _enc(string):
+  # Class names, plugin names and categories repeat across many entries.
+  return string.encode("utf-8")
 
 
-def write_utf_string(buffer, string):
-  encoded = string.encode("utf-8")
-  buffer.write(struct.pack(">H", len(encoded)))
-  buffer.write(encoded)
+def read_utf_string(view, offset):
+  """Returns the string at offset and the offset just past it."""
+  (length,) = _U16.unpack_from(view, offset)
+  offset += _U16.size
+  return str(view[offset : offset + length], "utf-8"), offset + length
 
 
-def write_cache_file(categories, output_path):
-  """Writes categories to output."""
-  buffer = io.BytesIO()
-  buffer.write(struct.pack(">I", len(categories)))
-
+def serialize_cache(categories):
+  """Returns categories serialized in the Log4j2Plugins.dat format."""
+  # First pass: encode strings and size every record so the output can be
+  # packed into a single preallocated buffer.
+  records = []
+  total = _U32.size
   for category, entries in categories.items():
-    write_utf_string(buffer, category)
-    buffer.write(struct.pack(">I", len(entries)))
+    # Category name and entry count are written as a single record.
+    encoded = _enc(category)
+    header = _get_struct(f">H{len(encoded)}sI")
+    records.append((header, (len(encoded), encoded, len(entries))))
+    total += header.size
 
     for entry in entries.values():
-      write_utf_string(buffer, entry.key)
-      write_utf_string(buffer, entry.class_name)
-      write_utf_string(buffer, entry.name)
-      buffer.write(struct.pack(">?", entry.printable))
-      buffer.write(struct.pack(">?", entry.defer))
+      # Each entry is three length-prefixed strings followed by two flags.
+      k = _enc(entry.key)
+      c = _enc(entry.class_name)
+      n = _enc(entry.name)
+      record = _get_struct(f">H{len(k)}sH{len(c)}sH{len(n)}s??")
+      records.append((
+          record,
+          (len(k), k, len(c), c, len(n), n, entry.printable, entry.defer),
+      ))
+      total += record.size
+
+  out = bytearray(total)
+  _U32.pack_into(out, 0, len(categories))
+  offset = _U32.size
+  for record, values in records:
+    record.pack_into(out, offset, *values)
+    offset += record.size
+  return out
+
 
+def write_cache_file(categories, output_path):
+  """Writes categories to output."""
   with open(output_path, "wb") as cache_file:
-    cache_file.write(buffer.getvalue())
+    cache_file.write(serialize_cache(categories))
 
 
 def load_cache_files_from_bytes(byte_data, consolidated_plugins):
   """Loads byte_data into consolidated_plugins."""
-  buffer = io.BytesIO(byte_data)
+  # Parse in place: slicing a memoryview doesn't copy the underlying bytes.
+  view = memoryview(byte_data)
 
-  count = struct.unpack(">I", buffer.read(4))[0]
+  (count,) = _U32.unpack_from(view, 0)
+  offset = _U32.size
   for _ in range(count):
-    category = read_utf_string(buffer)
+    category, offset = read_utf_string(view, offset)
+    category = sys.intern(category)
     category_map = consolidated_plugins.setdefault(category, {})
 
-    entries = struct.unpack(">I", buffer.read(4))[0]
+    (entries,) = _U32.unpack_from(view, offset)
+    offset += _U32.size
+    new_entries = []
     for _ in range(entries):
-      key = read_utf_string(buffer)
-      class_name = read_utf_string(buffer)
-      name = read_utf_string(buffer)
-      printable = struct.unpack(">?", buffer.read(1))[0]
-      defer = struct.unpack(">?", buffer.read(1))[0]
-
-      if key in category_map:
-        print(
-            f"Warning: Collision detected for key '{key}' in category"
-            f" '{category}'. Existing entry will be overwritten."
-        )
-
-      entry = PluginEntry(key, class_name, name, printable, defer, category)
-      category_map[key] = entry
-
-
-def create_jar_with_data(dat_file_path, jar_file_path):
+      key, offset = read_utf_string(view, offset)
+      class_name, offset = read_utf_string(view, offset)
+      class_name = sys.intern(class_name)
+      name, offset = read_utf_string(view, offset)
+      printable, defer = _TWO_BOOLS.unpack_from(view, offset)
+      offset += _TWO_BOOLS.size
+      new_entries.append(
+          PluginEntry(key, class_name, name, printable, defer, category)
+      )
+
+    new_map = {entry.key: entry for entry in new_entries}
+    if len(new_map) != len(new_entries) or category_map.keys() & new_map:
+      _warn_collisions(category, category_map, new_entries)
+    category_map.update(new_map)
+
+
+def _warn_collisions(category, category_map, new_entries):
+  """Prints a warning for each entry that overwrites an earlier one."""
+  seen = set(category_map)
+  for entry in new_entries:
+    if entry.key in seen:
+      print(
+          f"Warning: Collision detected for key '{entry.key}' in category"
+          f" '{category}'. Existing entry will be overwritten."
+      )
+    seen.add(entry.key)
+
+
+def create_jar_with_bytes(data, jar_file_path):
   jar_internal_path = (
       "META-INF/org/apache/logging/log4j/core/config/plugins/Log4j2Plugins.dat"
   )
-  with zipfile.ZipFile(jar_file_path, "w", zipfile.ZIP_DEFLATED) as jar:
-    jar.write(dat_file_path, arcname=jar_internal_path)
+  # The payload is tiny, so a higher level buys nothing but CPU time.
+  with zipfile.ZipFile(
+      jar_file_path, "w", zipfile.ZIP_DEFLATED, compresslevel=1
+  ) as jar:
+    jar.writestr(jar_internal_path, data)
+
+
+# Every plugin entry used by the generated test files. The input jars and the
+# expected merge result pick from the same entries so they can't drift apart.
+ALL_ENTRIES = {
+    e.key: e
+    for e in (
+        PluginEntry("key1", "class1", "name1", True, False, "cat1"),
+        PluginEntry("key2", "class2", "name2", False, True, "cat1"),
+        PluginEntry("key3", "class3", "name3", True, True, "cat2"),
+        PluginEntry("key11", "class1", "name1", True, False, "cat1"),
+        PluginEntry("key12", "class2", "name2", False, True, "cat1"),
+        PluginEntry("key13", "class3", "name3", True, True, "cat3"),
+    )
+}
+
+
+def _plugins(*keys):
+  """Groups the given ALL_ENTRIES by category, preserving key order."""
+  categories = {}
+  for key in keys:
+    entry = ALL_ENTRIES[key]
+    categories.setdefault(entry.category, {})[key] = entry
+  return categories
 
 
 if __name__ == "__main__":
@@ -129,76 +209,16 @@ if __name__ == "__main__":
     sys.exit(0)
 
   values = [
-      (
-          "log4j2_plugins_set_1.jar",
-          {
-              "cat1": {
-                  "key1": PluginEntry(
-                      "key1", "class1", "name1", True, False, "cat1"
-                  ),
-                  "key2": PluginEntry(
-                      "key2", "class2", "name2", False, True, "cat1"
-                  ),
-              },
-              "cat2": {
-                  "key3": PluginEntry(
-                      "key3", "class3", "name3", True, True, "cat2"
-                  )
-              },
-          },
-      ),
-      (
-          "log4j2_plugins_set_2.jar",
-          {
-              "cat1": {
-                  "key11": PluginEntry(
-                      "key11", "class1", "name1", True, False, "cat1"
-                  ),
-                  "key12": PluginEntry(
-                      "key12", "class2", "name2", False, True, "cat1"
-                  ),
-              },
-              "cat3": {
-                  "key13": PluginEntry(
-                      "key13", "class3", "name3", True, True, "cat3"
-                  ),
-              },
-          },
-      ),
+      ("log4j2_plugins_set_1.jar", _plugins("key1", "key2", "key3")),
+      ("log4j2_plugins_set_2.jar", _plugins("key11", "key12", "key13")),
   ]
 
   for v in values:
-    dat = os.path.join(args.data_dir, "temp.dat")
-    write_cache_file(v[1], dat)
-    create_jar_with_data(dat, os.path.join(args.data_dir, v[0]))
-    os.remove(dat)
+    create_jar_with_bytes(
+        serialize_cache(v[1]), os.path.join(args.data_dir, v[0])
+    )
 
   write_cache_file(
-      {
-          "cat1": {
-              "key1": PluginEntry(
-                  "key1", "class1", "name1", True, False, "cat1"
-              ),
-              "key11": PluginEntry(
-                  "key11", "class1", "name1", True, False, "cat1"
-              ),
-              "key12": PluginEntry(
-                  "key12", "class2", "name2", False, True, "cat1"
-              ),
-              "key2": PluginEntry(
-                  "key2", "class2", "name2", False, True, "cat1"
-              ),
-          },
-          "cat2": {
-              "key3": PluginEntry(
-                  "key3", "class3", "name3", True, True, "cat2"
-              ),
-          },
-          "cat3": {
-              "key13": PluginEntry(
-                  "key13", "class3", "name3", True, True, "cat3"
-              ),
-          },
-      },
+      _plugins("key1", "key11", "key12", "key2", "key3", "key13"),
       os.path.join(args.data_dir, "log4j2_plugins_set_result.dat"),
   )
@@ -15,11 +15,16 @@
 
 There's no Python Bazel API so we invoke Bazel as a subprocess.
 """
-import json
+import functools
 import os
 import subprocess
+import sys
+import tempfile
 from typing import Callable
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Sequence
 from typing import Tuple
 from frozendict import frozendict
 from tools.ctexplain.types import Configuration
@@ -27,8 +32,15 @@ from tools.ctexplain.types import ConfiguredTarget
 from tools.ctexplain.types import HostConfiguration
 from tools.ctexplain.types import NullConfiguration
 
+# orjson parses large "bazel config" output several times faster. It's
+# optional: fall back to the standard library when it isn't installed.
+try:
+  import orjson as _json  # pylint: disable=g-import-not-at-top
+except ImportError:
+  import json as _json  # pylint: disable=g-import-not-at-top
 
-def run_bazel_in_client(args: List[str]) -> Tuple[int, List[str], List[str]]:
+
+def run_bazel_in_client(args: List[str]) -> Tuple[int, List[str], str]:
   """Calls bazel within the current workspace.
 
   For production use. Tests use an alternative invoker that goes through test
@@ -38,26 +50,75 @@ def run_bazel_in_client(args: List[str]) -> Tuple[int, List[str], List[str]]:
     args: the arguments to call Bazel with
 
   Returns:
-    Tuple of (return code, stdout, stderr)
+    Tuple of (return code, stdout lines, stderr text)
   """
   result = subprocess.run(
       ["blaze"] + args,
       cwd=os.getcwd(),
       stdout=subprocess.PIPE,
       stderr=subprocess.PIPE,
-      check=False)
-  return (result.returncode, result.stdout.decode("utf-8").split(os.linesep),
-          result.stderr)
+      check=False,
+      text=True,
+      encoding="utf-8")
+  return (result.returncode, result.stdout.splitlines(), result.stderr)
+
+
+def run_bazel_streaming_in_client(
+    args: List[str],
+    bazel_command: Sequence[str] = ("blaze",)
+) -> Tuple[Iterator[str], Callable[[], Tuple[int, str]]]:
+  """Calls bazel within the current workspace, streaming its stdout.
+
+  For production use. Unlike run_bazel_in_client, stdout lines can be consumed
+  while Bazel is still running.
+
+  Args:
+    args: the arguments to call Bazel with
+    bazel_command: the Bazel binary and any startup options to call it with
+
+  Returns:
+    Tuple of (stdout lines, wait). wait() blocks until Bazel exits and returns
+    (return code, stderr). Call it after consuming stdout.
+  """
+  # Send stderr to a file: Bazel's progress messages would otherwise fill the
+  # pipe and block Bazel while we're still reading stdout.
+  stderr_file = tempfile.TemporaryFile()
+  try:
+    process = subprocess.Popen(
+        list(bazel_command) + args,
+        cwd=os.getcwd(),
+        stdout=subprocess.PIPE,
+        stderr=stderr_file,
+        encoding="utf-8",
+        bufsize=1)
+  except Exception:
+    stderr_file.close()
+    raise
+
+  def wait() -> Tuple[int, str]:
+    process.stdout.close()
+    returncode = process.wait()
+    with stderr_file:
+      stderr_file.seek(0)
+      return (returncode, stderr_file.read().decode("utf-8"))
+
+  return ((line.rstrip("\n") for line in process.stdout), wait)
 
 
 class BazelApi():
   """API that accepts injectable Bazel invocation logic."""
 
-  def __init__(self,
-               run_bazel: Callable[[List[str]],
-                                   Tuple[int, List[str],
-                                         List[str]]] = run_bazel_in_client):
+  def __init__(
+      self,
+      run_bazel: Callable[[List[str]], Tuple[int, List[str],
+                                             str]] = run_bazel_in_client,
+      run_bazel_streaming: Optional[Callable[[List[str]], Tuple[
+          Iterator[str], Callable[[], Tuple[int, str]]]]] = None):
+    # Tests inject TestBase.RunBazel, which returns stderr as a list of lines
+    # rather than a str. The tests join those lines themselves.
     self.run_bazel = run_bazel
+    # If set, cquery parses output as it arrives instead of calling run_bazel.
+    self.run_bazel_streaming = run_bazel_streaming
 
   def cquery(self,
              args: List[str]) -> Tuple[bool, str, Tuple[ConfiguredTarget, ...]]:
@@ -77,19 +138,33 @@ class BazelApi():
       if A depends on B, A appears before B.
     """
     base_args = ["cquery", "--show_config_fragments=transitive"]
+    if self.run_bazel_streaming:
+      return self._cquery_streaming(base_args + args)
     (returncode, stdout, stderr) = self.run_bazel(base_args + args)
     if returncode != 0:
       return (False, stderr, ())
 
-    cts = []
-    for line in stdout:
-      if not line.strip():
-        continue
-      ctinfo = _parse_cquery_result_line(line)
-      if ctinfo is not None:
-        cts.append(ctinfo)
-
-    return (True, stderr, tuple(cts))
+    cts = tuple(filter(None, map(_parse_cquery_result_line, stdout)))
+    return (True, stderr, cts)
+
+  def _cquery_streaming(
+      self, args: List[str]) -> Tuple[bool, str, Tuple[ConfiguredTarget, ...]]:
+    """Like cquery, but parses each output line as Bazel prints it."""
+    (stdout, wait) = self.run_bazel_streaming(args)
+    parse_error = None
+    try:
+      cts = tuple(filter(None, map(_parse_cquery_result_line, stdout)))
+    except ValueError as e:
+      parse_error = e
+    finally:
+      (returncode, stderr) = wait()
+    # The output of a failed query needn't be results, so report the failure
+    # rather than any parse error, as cquery does.
+    if returncode != 0:
+      return (False, stderr, ())
+    if parse_error:
+      raise parse_error
+    return (True, stderr, cts)
 
   def get_config(self, config_hash: str) -> Configuration:
     """Calls "bazel config" with the given config hash.
@@ -112,22 +187,22 @@ class BazelApi():
     (returncode, stdout, stderr) = self.run_bazel(base_args + [config_hash])
     if returncode != 0:
       raise ValueError("Could not get config: " + stderr)
-    config_json = json.loads(os.linesep.join(stdout))
-    fragments = frozendict({
-        _base_name(entry["name"]):
-        tuple(_base_name(clazz) for clazz in entry["fragmentOptions"])
-        for entry in config_json["fragments"]
-    })
-    options = frozendict({
-        _base_name(entry["name"]): frozendict(entry["options"])
-        for entry in config_json["fragmentOptions"]
-    })
+    # Newlines are insignificant whitespace in JSON, so "\n" joins just fine.
+    config_json = _json.loads("\n".join(stdout))
+    # Build the frozendicts straight from generators: no intermediate dicts.
+    fragments = frozendict(
+        (_base_name(entry["name"]),
+         tuple(_base_name(clazz) for clazz in entry["fragmentOptions"]))
+        for entry in config_json["fragments"])
+    options = frozendict(
+        (_base_name(entry["name"]), frozendict(entry["options"]))
+        for entry in config_json["fragmentOptions"])
     return Configuration(fragments, options)
 
 
 # TODO(gregce): have cquery --output=jsonproto support --show_config_fragments
-# so we can replace all this regex parsing with JSON reads.
-def _parse_cquery_result_line(line: str) -> ConfiguredTarget:
+# so we can replace all this string parsing with JSON reads.
+def _parse_cquery_result_line(line: str) -> Optional[ConfiguredTarget]:
   """Converts a cquery output line to a ConfiguredTarget.
 
   Expected input is:
@@ -141,22 +216,44 @@ def _parse_cquery_result_line(line: str) -> ConfiguredTarget:
     line: The expected input.
 
   Returns:
-    Corresponding ConfiguredTarget if the line matches else None.
+    Corresponding ConfiguredTarget, or None if the line is blank.
+
+  Raises:
+    ValueError: If the line is neither blank nor in the expected format.
   """
-  tokens = line.split(maxsplit=2)
-  label = tokens[0]
-  if tokens[1][0] != "(" or tokens[1][-1] != ")":
-    raise ValueError(f"{tokens[1]} in {line} not surrounded by parentheses")
-  config_hash = tokens[1][1:-1]
+  line = line.strip()
+  if not line:
+    return None
+  # Source files and other null-configured targets are common and need no
+  # further scanning.
+  if line.endswith(" (null)"):
+    return ConfiguredTarget(
+        label=line[:-len(" (null)")].rstrip(),
+        config=None,
+        config_hash="null",
+        transitive_fragments=())
+  # Scan from the right with plain string searches: this is called for every
+  # line of cquery output, so it avoids the regex engine.
+  if line[-1] == "]":
+    open_bracket = line.rfind(" [")
+    if open_bracket < 0:
+      raise ValueError(f"Config fragments in {line} not surrounded by []")
+    fragments_str = line[open_bracket + 2:-1]
+    line_head = line[:open_bracket].rstrip()
+  else:
+    fragments_str = None
+    line_head = line
+  open_paren = line_head.rfind(" (")
+  if open_paren < 0 or line_head[-1] != ")":
+    raise ValueError(f"Config hash in {line} not surrounded by parentheses")
+  label = line_head[:open_paren].rstrip()
+  config_hash = sys.intern(line_head[open_paren + 2:-1])
   if config_hash == "null":
     fragments = ()
+  elif fragments_str is None:
+    raise ValueError(f"No config fragments for {label} in {line}")
   else:
-    if tokens[2][0] != "[" or tokens[2][-1] != "]":
-      raise ValueError(f"{tokens[2]} in {line} not surrounded by [] brackets")
-    # The fragments list looks like '[Fragment1, Fragment2, ...]'. Split the
-    # whole line on ' [' to get just this list, then remove the final ']', then
-    # split again on ', ' to convert it to a structured tuple.
-    fragments = tuple(line.split(" [")[1][0:-1].split(", "))
+    fragments = _split_fragments(fragments_str)
   return ConfiguredTarget(
       label=label,
       config=None,  # Not yet available: we'll need `bazel config` to get this.
@@ -164,6 +261,25 @@ def _parse_cquery_result_line(line: str) -> ConfiguredTarget:
       transitive_fragments=fragments)
 
 
+@functools.lru_cache(maxsize=1024)
+def _split_fragments(fragments_str: str) -> Tuple[str, ...]:
+  """Converts 'Fragment1, Fragment2, ...' to a tuple of fragment names.
+
+  There are few distinct fragment names and lists across a cquery, so names
+  are interned and identical lists share the same tuple.
+
+  Args:
+    fragments_str: The fragments list without its surrounding [] brackets.
+
+  Returns:
+    The fragment names in order.
+  """
+  if not fragments_str:
+    return ()
+  return tuple(sys.intern(f) for f in fragments_str.split(", "))
+
+
+@functools.lru_cache(maxsize=4096)
 def _base_name(full_name: str) -> str:
   """Strips a fully qualified Java class name to the file scope.
 
@@ -177,4 +293,4 @@ def _base_name(full_name: str) -> str:
   Returns:
     Stripped name.
   """
-  return full_name.split(".")[-1]
+  return full_name.rpartition(".")[2]
@@ -12,10 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Tests for bazel_api.py."""
+import functools
 import os
+import sys
 import unittest
 from src.test.py.bazel import test_base
 from tools.ctexplain.bazel_api import BazelApi
+from tools.ctexplain.bazel_api import run_bazel_streaming_in_client
 from tools.ctexplain.types import HostConfiguration
 from tools.ctexplain.types import NullConfiguration
 
@@ -55,6 +58,44 @@ class BazelApiTest(test_base.TestBase):
     self.assertIn("target 'typo' not declared in package 'testapp'",
                   os.linesep.join(stderr))
 
+  def _StreamingBazelApi(self):
+    """Returns a BazelApi streaming from a real subprocess faking cquery."""
+    fake_bazel = self.ScratchFile('fake_bazel.py', [
+        'import sys',
+        # More stderr than a pipe buffer holds, like Bazel's progress output.
+        'for i in range(100000):',
+        '  sys.stderr.write("progress %d\\n" % i)',
+        'if "//testapp:typo" in sys.argv:',
+        '  print("Loading: 0 packages loaded")',
+        '  sys.stderr.write("ERROR: no such target \'//testapp:typo\'\\n")',
+        '  sys.exit(1)',
+        'print("//testapp:fg (abc123) [PlatformConfiguration, TestOptions]")',
+        'print("//testapp:a.file (null)")',
+    ])
+    return BazelApi(
+        run_bazel_streaming=functools.partial(
+            run_bazel_streaming_in_client,
+            bazel_command=[sys.executable, fake_bazel]))
+
+  def testCqueryStreamingFromSubprocess(self):
+    bazel_api = self._StreamingBazelApi()
+    (success, stderr, cts) = bazel_api.cquery(['//testapp:all'])
+    self.assertTrue(success)
+    self.assertIn('progress 99999', stderr)
+    self.assertEqual([ct.label for ct in cts],
+                     ['//testapp:fg', '//testapp:a.file'])
+    self.assertEqual(cts[0].config_hash, 'abc123')
+    self.assertEqual(cts[0].transitive_fragments,
+                     ('PlatformConfiguration', 'TestOptions'))
+    self.assertEqual(cts[1].config_hash, 'null')
+
+  def testFailedCqueryStreamingFromSubprocess(self):
+    bazel_api = self._StreamingBazelApi()
+    (success, stderr, cts) = bazel_api.cquery(['//testapp:typo'])
+    self.assertFalse(success)
+    self.assertEqual(len(cts), 0)
+    self.assertIn("ERROR: no such target '//testapp:typo'", stderr)
+
   def testTransitiveFragmentsAccuracy(self):
     self.ScratchFile('testapp/BUILD', [
         'filegroup(name = "fg", srcs = ["a.file"])',
@@ -43,6 +43,7 @@ from dataclasses import dataclass
 
 import tools.ctexplain.analyses.summary as summary
 from tools.ctexplain.bazel_api import BazelApi
+from tools.ctexplain.bazel_api import run_bazel_streaming_in_client
 import tools.ctexplain.lib as lib
 from tools.ctexplain.types import ConfiguredTarget
 import tools.ctexplain.util as util
@@ -148,7 +149,8 @@ def main(argv):
   (labels, build_flags) = _get_build_flags(FLAGS.build[0])
   build_desc = ",".join(labels)
   with util.ProgressStep(f"Collecting configured targets for {build_desc}"):
-    cts = lib.analyze_build(BazelApi(), labels, build_flags)
+    bazel = BazelApi(run_bazel_streaming=run_bazel_streaming_in_client)
+    cts = lib.analyze_build(bazel, labels, build_flags)
   for analysis in FLAGS.analysis:
     analyses[analysis].exec(cts)
 
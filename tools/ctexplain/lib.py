@@ -37,7 +37,7 @@ def analyze_build(bazel: bazel_api.BazelApi, labels: Tuple[str, ...],
   cquery_args.extend(build_flags)
   (success, stderr, cts) = bazel.cquery(cquery_args)
   if not success:
-    raise RuntimeError("invocation failed: " + stderr.decode("utf-8"))
+    raise RuntimeError("invocation failed: " + stderr)
 
   # We have to do separate calls to "bazel config" to get the actual configs
   # from their hashes.